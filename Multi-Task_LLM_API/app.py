@@ -1,12 +1,50 @@
 
-from flask import Flask, request, jsonify
+import os
+import re
+import logging
+import redis
+import orjson
+from typing import List
+from pydantic import BaseModel, Field, ValidationError
+from flask import Flask, Response, request, jsonify, make_response, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_restx import Api, Resource, fields
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
-from gemini_wrapper import generate_text, generate_code, classify_text
+from gemini_wrapper import (
+    generate_text, generate_code, classify_text,
+    stream_text, stream_code, stream_classify,
+    warm_up,
+)
+from llm_cache import llm_cache, semantic_cache
+from rate_limit import TokenBucketLimiter
+
+logger = logging.getLogger(__name__)
+
+class PromptRequest(BaseModel):
+    prompt: str = Field(min_length=1)
+
+class ClassifyRequest(BaseModel):
+    text: str = Field(min_length=1)
+    categories: List[str] = Field(min_length=1)
+
+def validation_error(message, error):
+    """Build a 400 response body from a pydantic ValidationError"""
+    # Inputs are left out since they may be the raw request bytes, which JSON cannot encode
+    return {'error': message, 'details': error.errors(include_url=False, include_context=False, include_input=False)}, 400
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 
 api = Api(
     app, 
@@ -17,15 +55,60 @@ api = Api(
     prefix='/api/v1'
 )
 
+@api.representation('application/json')
+def output_json(data, code, headers=None):
+    """Serialize Flask-RESTX resource responses with orjson"""
+    response = make_response(orjson.dumps(data), code)
+    response.headers.extend(headers or {})
+    response.mimetype = 'application/json'
+    return response
+
+# Per-client token bucket on each LLM endpoint: 10 requests, refilled at 10 per minute
+ENDPOINT_RATE_LIMIT_CAPACITY = 10
+ENDPOINT_RATE_LIMIT_REFILL = 10 / 60
+
+def connect_rate_limit_storage():
+    """Return the rate limit storage URI and a Redis client for it, falling back to memory:// if Redis is unreachable"""
+    storage_uri = os.getenv("RATELIMIT_STORAGE_URI", "redis://localhost:6379/1")
+    if not storage_uri.startswith(("redis://", "rediss://")):
+        return storage_uri, None
+    client = redis.Redis.from_url(storage_uri, socket_connect_timeout=1)
+    try:
+        client.ping()
+    except redis.RedisError as e:
+        logger.warning(f"Redis unavailable at {storage_uri} ({e}), falling back to in-memory rate limiting")
+        return "memory://", None
+    return storage_uri, client
+
+rate_limit_storage_uri, rate_limit_redis = connect_rate_limit_storage()
+
 limiter = Limiter(
     get_remote_address,
     app=app,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://",
+    storage_uri=rate_limit_storage_uri,
+    strategy="fixed-window",
+    # Keep limiting in process memory if Redis goes away after startup
+    in_memory_fallback_enabled=True,
 )
 
+token_bucket = TokenBucketLimiter(rate_limit_redis)
+
+RATE_LIMITED_PATHS = {'/api/v1/generate/text', '/api/v1/generate/code', '/api/v1/classify/text'}
+
+@app.before_request
+def enforce_endpoint_rate_limit():
+    """Reject requests to the LLM endpoints once the client's token bucket is empty"""
+    if request.path not in RATE_LIMITED_PATHS:
+        return None
+    key = f"rl:{get_remote_address()}:{request.path}"
+    if not token_bucket.allow(key, ENDPOINT_RATE_LIMIT_CAPACITY, ENDPOINT_RATE_LIMIT_REFILL):
+        return jsonify({'error': 'Rate limit exceeded'}), 429
+    return None
+
 ns_generate = api.namespace('generate', description='Text and code generation operations')
 ns_classify = api.namespace('classify', description='Text classification operations')
+ns_metrics = api.namespace('metrics', description='Service observability')
 
 text_generation_model = api.model('TextGeneration', {
     'prompt': fields.String(required=True, description='The text prompt for generation', example='Write a short story about a robot')
@@ -52,30 +135,65 @@ classification_response_model = api.model('ClassificationResponse', {
     'classification': fields.String(description='The classification result')
 })
 
+cache_stats_model = api.model('CacheStats', {
+    'hits': fields.Integer(description='Number of responses served from the cache'),
+    'misses': fields.Integer(description='Number of cache lookups that required an LLM call'),
+    'size': fields.Integer(description='Number of cached responses'),
+    'maxsize': fields.Integer(description='Maximum number of cached responses')
+})
+
+metrics_model = api.inherit('Metrics', cache_stats_model, {
+    'semantic': fields.Nested(cache_stats_model, description='Embedding similarity cache statistics for classification')
+})
+
 error_model = api.model('Error', {
     'error': fields.String(description='Error message')
 })
 
 
 
+def wants_event_stream():
+    """Check if the client asked for a Server-Sent Events response"""
+    return request.accept_mimetypes.best_match(['application/json', 'text/event-stream']) == 'text/event-stream'
+
+def sse_event(text, event=None):
+    """Format text as one Server-Sent Event, prefixing every line so embedded newlines cannot end it early"""
+    header = f"event: {event}\n" if event else ''
+    return header + ''.join(f"data: {line}\n" for line in re.split(r'\r\n|\r|\n', text)) + '\n'
+
+def event_stream(chunks):
+    """Relay generated chunks to the client as Server-Sent Events"""
+    def generate():
+        try:
+            for chunk in chunks:
+                yield sse_event(chunk)
+        except Exception as e:
+            yield sse_event(str(e), event='error')
+    return Response(stream_with_context(generate()), mimetype='text/event-stream')
 
 @ns_generate.route('/text')
 class TextGeneration(Resource):
+    # Limited only by the token bucket in enforce_endpoint_rate_limit, so Flask-Limiter stays off the hot path
+    decorators = [limiter.exempt]
+
     @ns_generate.expect(text_generation_model)
     @ns_generate.doc(
-        description='Generate text based on a given prompt using Google Gemini Pro',
+        description='Generate text based on a given prompt using Google Gemini Pro. Send Accept: text/event-stream to stream the response as Server-Sent Events',
         responses={
             200: 'Success - Text generated',
-            400: 'Bad Request - Missing prompt',
+            400: 'Bad Request - Missing or invalid prompt',
+            429: 'Too Many Requests - Rate limit exceeded',
             500: 'Internal Server Error'
         }
     )
-    @limiter.limit("10 per minute")
     def post(self):
-        data = request.get_json()
-        prompt = data.get('prompt')
-        if not prompt:
-            return {'error': 'Prompt is required'}, 400
+        try:
+            prompt = PromptRequest.model_validate_json(request.get_data()).prompt
+        except ValidationError as e:
+            return validation_error('Prompt is required', e)
+
+        if wants_event_stream():
+            return event_stream(stream_text(prompt))
         
         try:
             text = generate_text(prompt)
@@ -85,22 +203,27 @@ class TextGeneration(Resource):
 
 @ns_generate.route('/code')
 class CodeGeneration(Resource):
+    # Limited only by the token bucket in enforce_endpoint_rate_limit, so Flask-Limiter stays off the hot path
+    decorators = [limiter.exempt]
+
     @ns_generate.expect(code_generation_model)
     @ns_generate.doc(
-        description='Generate code based on a given prompt using Google Gemini Pro with optimized settings for code generation',
+        description='Generate code based on a given prompt using Google Gemini Pro with optimized settings for code generation. Send Accept: text/event-stream to stream the response as Server-Sent Events',
         responses={
             200: 'Success - Code generated',
-            400: 'Bad Request - Missing prompt',
+            400: 'Bad Request - Missing or invalid prompt',
+            429: 'Too Many Requests - Rate limit exceeded',
             500: 'Internal Server Error'
         }
     )
-    @limiter.limit("10 per minute")
     def post(self):
-        data = request.get_json()
-        prompt = data.get('prompt')
+        try:
+            prompt = PromptRequest.model_validate_json(request.get_data()).prompt
+        except ValidationError as e:
+            return validation_error('Prompt is required', e)
 
-        if not prompt:
-            return {'error': 'Prompt is required'}, 400
+        if wants_event_stream():
+            return event_stream(stream_code(prompt))
 
         try:
             code = generate_code(prompt)
@@ -110,23 +233,28 @@ class CodeGeneration(Resource):
 
 @ns_classify.route('/text')
 class TextClassification(Resource):
+    # Limited only by the token bucket in enforce_endpoint_rate_limit, so Flask-Limiter stays off the hot path
+    decorators = [limiter.exempt]
+
     @ns_classify.expect(text_classification_model)
     @ns_classify.doc(
-        description='Classify text into one of the provided categories using Google Gemini Pro',
+        description='Classify text into one of the provided categories using Google Gemini Pro. Send Accept: text/event-stream to stream the response as Server-Sent Events',
         responses={
             200: 'Success - Text classified',
-            400: 'Bad Request - Missing text or categories',
+            400: 'Bad Request - Missing or invalid text or categories',
+            429: 'Too Many Requests - Rate limit exceeded',
             500: 'Internal Server Error'
         }
     )
-    @limiter.limit("10 per minute")
     def post(self):
-        data = request.get_json()
-        text = data.get('text')
-        categories = data.get('categories')
+        try:
+            body = ClassifyRequest.model_validate_json(request.get_data())
+        except ValidationError as e:
+            return validation_error('Text and categories are required', e)
+        text, categories = body.text, body.categories
 
-        if not text or not categories:
-            return {'error': 'Text and categories are required'}, 400
+        if wants_event_stream():
+            return event_stream(stream_classify(text, categories))
 
         try:
             classification = classify_text(text, categories)
@@ -134,5 +262,31 @@ class TextClassification(Resource):
         except Exception as e:
             return {'error': str(e)}, 500
 
+@ns_metrics.route('')
+class Metrics(Resource):
+    decorators = [limiter.exempt]
+
+    @ns_metrics.doc(
+        description='Report response cache and semantic cache hit/miss statistics',
+        responses={
+            200: 'Success - Metrics returned'
+        }
+    )
+    @ns_metrics.marshal_with(metrics_model)
+    def get(self):
+        return {**llm_cache.stats, 'semantic': semantic_cache.stats}
+
+def warm_up_enabled():
+    return os.getenv("GEMINI_WARMUP", "true").lower() == "true"
+
+def create_app():
+    """Serving entrypoint (waitress-serve --call app:create_app) that warms up Gemini before taking traffic"""
+    if warm_up_enabled():
+        warm_up()
+    return app
+
 if __name__ == '__main__':
+    # The debug reloader imports this module in a parent and a child process; only the child serves
+    if warm_up_enabled() and os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        warm_up()
     app.run(debug=True)
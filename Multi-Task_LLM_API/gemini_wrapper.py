@@ -1,17 +1,175 @@
 import os
 import time
 import logging
+import queue
+import asyncio
+import functools
+import threading
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 from langchain.schema import HumanMessage
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 from google.api_core import exceptions as google_exceptions
+from cachetools import LRUCache
+
+from llm_cache import cached_llm, semantic_cached_llm, single_flight
 
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+MODEL_NAME = "gemini-2.0-flash-exp"
+TEXT_TEMPERATURE = 0.7
+CODE_TEMPERATURE = 0.2
+CLASSIFY_TEMPERATURE = 0
+EMBEDDING_MODEL = "models/embedding-001"
+
+WARMUP_TIMEOUT = 10
+
+async def _aget_async_client(llm):
+    return llm.async_client
+
+def _build_async_client(llm):
+    """Create the client's grpc.aio service on the shared event loop, where every async call runs"""
+    try:
+        on_shared_loop = asyncio.get_running_loop() is _loop
+    except RuntimeError:
+        on_shared_loop = False
+    # The async_client property only builds the service while an event loop is running
+    if on_shared_loop:
+        return llm.async_client
+    return run_async(_aget_async_client(llm))
+
+# Transport sharing relies on the lazily built async client held in this internal field
+# (langchain-google-genai < 3); without it each temperature gets its own client
+SHARES_ASYNC_CLIENT = "async_client_running" in ChatGoogleGenerativeAI.model_fields
+
+def _new_llm(temperature):
+    return ChatGoogleGenerativeAI(
+        model=MODEL_NAME,
+        temperature=temperature,
+        google_api_key=os.getenv("GOOGLE_API_KEY")
+    )
+
+@functools.lru_cache(maxsize=None)
+def _get_base_llm():
+    """Return the Gemini client owning the process-wide transports, built on first use"""
+    logger.info("Initializing Gemini client")
+    llm = _new_llm(CLASSIFY_TEMPERATURE)
+    _build_async_client(llm)
+    return llm
+
+@functools.lru_cache(maxsize=None)
+def _get_llm(temperature):
+    """Return a shared Gemini client for the given temperature"""
+    if not SHARES_ASYNC_CLIENT:
+        logger.info(f"Initializing Gemini client (temperature={temperature})")
+        return _new_llm(temperature)
+    # A shallow copy shares the base client's sync and async generative services,
+    # so every temperature reuses the same channels and their open connections
+    base = _get_base_llm()
+    return base.model_copy(update={
+        "temperature": temperature,
+        "async_client_running": base.async_client_running,
+    })
+
+@functools.lru_cache(maxsize=None)
+def _get_embeddings():
+    """Return the shared Gemini embeddings client, built on first use"""
+    return GoogleGenerativeAIEmbeddings(
+        model=EMBEDDING_MODEL,
+        google_api_key=os.getenv("GOOGLE_API_KEY")
+    )
+
+_embedding_cache = LRUCache(maxsize=10_000)
+
+async def aembed_text(text):
+    """Embed text for the semantic cache, reusing previously computed embeddings"""
+    vector = _embedding_cache.get(text)
+    if vector is None:
+        vector = await _get_embeddings().aembed_query(text)
+        _embedding_cache[text] = vector
+    return vector
+
+# All Gemini calls run on one background loop so they share the grpc.aio transport and the
+# single-flight map. Request threads still block until their call finishes, so the number
+# of in-flight requests remains bounded by the WSGI server's thread count.
+_loop = None
+_loop_lock = threading.Lock()
+
+def _get_event_loop():
+    """Return the shared background event loop, starting it on first use"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="gemini-event-loop", daemon=True).start()
+        return _loop
+
+def run_async(coro):
+    """Run a coroutine on the shared event loop and block until it completes"""
+    return asyncio.run_coroutine_threadsafe(coro, _get_event_loop()).result()
+
+_STREAM_END = object()
+
+def iter_async(async_iterable):
+    """Consume an async iterable on the shared event loop as a blocking generator"""
+    items = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in async_iterable:
+                items.put(item)
+        finally:
+            items.put(_STREAM_END)
+
+    future = asyncio.run_coroutine_threadsafe(pump(), _get_event_loop())
+    try:
+        while (item := items.get()) is not _STREAM_END:
+            yield item
+        future.result()
+    finally:
+        future.cancel()
+
+def _text_messages(prompt):
+    return [HumanMessage(content=prompt)]
+
+def _code_messages(prompt):
+    return [
+        HumanMessage(content=f"You are a helpful coding assistant. Generate code for the following prompt: {prompt}"),
+    ]
+
+# The category clause leads the prompt so requests sharing a label set share a stable prefix
+CLASSIFY_TEXT_OPEN = "Only return the category name. Text: '"
+CLASSIFY_TEXT_CLOSE = "'"
+
+@functools.lru_cache(maxsize=256)
+def _categories_clause(categories):
+    return f"Classify the text into one of the following categories: {', '.join(categories)}. "
+
+def _classify_messages(text, categories):
+    prompt = _categories_clause(tuple(categories)) + CLASSIFY_TEXT_OPEN + text + CLASSIFY_TEXT_CLOSE
+    return [
+        HumanMessage(content=prompt),
+    ]
+
+async def _awarm_up():
+    llms = [_get_llm(temperature) for temperature in (TEXT_TEMPERATURE, CODE_TEMPERATURE, CLASSIFY_TEMPERATURE)]
+    if SHARES_ASYNC_CLIENT:
+        # One request opens the connection every client shares; more would only be billed
+        llms = llms[:1]
+    await asyncio.gather(*(asyncio.wait_for(llm.ainvoke("ping"), WARMUP_TIMEOUT) for llm in llms))
+
+def warm_up():
+    """Build the shared clients and open their connection before the first request arrives"""
+    try:
+        logger.info("Warming up Gemini clients")
+        run_async(_awarm_up())
+        logger.info("Gemini clients warmed up")
+    except Exception as e:
+        logger.warning(f"Gemini warm-up failed, clients will initialize on first request: {e}")
+
 def is_rate_limit_error(exception):
     """Check if the exception is a rate limit error"""
     if hasattr(exception, 'status_code'):
@@ -31,22 +189,20 @@ def retry_on_rate_limit(exception):
         logger.warning(f"Rate limit hit: {exception}. Retrying with exponential backoff...")
     return should_retry
 
+@cached_llm(MODEL_NAME, TEXT_TEMPERATURE)
+@single_flight(MODEL_NAME, TEXT_TEMPERATURE)
 @retry(
     retry=retry_on_rate_limit,
     stop=stop_after_attempt(5),
     wait=wait_exponential(multiplier=1, min=1, max=60),
     reraise=True
 )
-def generate_text(prompt):
+async def agenerate_text(prompt):
     try:
         logger.info("Generating text with Gemini 2.0 Flash")
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash-exp", 
-            temperature=0.7,
-            google_api_key=os.getenv("GOOGLE_API_KEY")
-        )
-        messages = [HumanMessage(content=prompt)]
-        response = llm.invoke(messages)
+        llm = _get_llm(TEXT_TEMPERATURE)
+        messages = _text_messages(prompt)
+        response = await llm.ainvoke(messages)
         logger.info("Text generation completed successfully")
         return response.content
     except Exception as e:
@@ -55,24 +211,20 @@ def generate_text(prompt):
             logger.warning("Rate limit detected, will retry with exponential backoff")
         raise e
 
+@cached_llm(MODEL_NAME, CODE_TEMPERATURE)
+@single_flight(MODEL_NAME, CODE_TEMPERATURE)
 @retry(
     retry=retry_on_rate_limit,
     stop=stop_after_attempt(5),
     wait=wait_exponential(multiplier=1, min=1, max=60),
     reraise=True
 )
-def generate_code(prompt):
+async def agenerate_code(prompt):
     try:
         logger.info("Generating code with Gemini 2.0 Flash")
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash-exp", 
-            temperature=0.2,
-            google_api_key=os.getenv("GOOGLE_API_KEY")
-        )
-        messages = [
-            HumanMessage(content=f"You are a helpful coding assistant. Generate code for the following prompt: {prompt}"),
-        ]
-        response = llm.invoke(messages)
+        llm = _get_llm(CODE_TEMPERATURE)
+        messages = _code_messages(prompt)
+        response = await llm.ainvoke(messages)
         logger.info("Code generation completed successfully")
         return response.content
     except Exception as e:
@@ -81,29 +233,58 @@ def generate_code(prompt):
             logger.warning("Rate limit detected, will retry with exponential backoff")
         raise e
 
+@cached_llm(MODEL_NAME, CLASSIFY_TEMPERATURE)
+@single_flight(MODEL_NAME, CLASSIFY_TEMPERATURE)
+@semantic_cached_llm(aembed_text)
 @retry(
     retry=retry_on_rate_limit,
     stop=stop_after_attempt(5),
     wait=wait_exponential(multiplier=1, min=1, max=60),
     reraise=True
 )
-def classify_text(text, categories):
+async def aclassify_text(text, categories):
     try:
         logger.info("Classifying text with Gemini 2.0 Flash")
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash-exp", 
-            temperature=0,
-            google_api_key=os.getenv("GOOGLE_API_KEY")
-        )
-        prompt = f"Classify the following text: '{text}' into one of the following categories: {', '.join(categories)}. Only return the category name."
-        messages = [
-            HumanMessage(content=prompt),
-        ]
-        response = llm.invoke(messages)
+        llm = _get_llm(CLASSIFY_TEMPERATURE)
+        messages = _classify_messages(text, categories)
+        response = await llm.ainvoke(messages)
         logger.info("Text classification completed successfully")
         return response.content
     except Exception as e:
         logger.error(f"Error in classify_text: {str(e)}")
         if is_rate_limit_error(e):
             logger.warning("Rate limit detected, will retry with exponential backoff")
-        raise e
\ No newline at end of file
+        raise e
+
+async def astream_text(prompt):
+    logger.info("Streaming text with Gemini 2.0 Flash")
+    async for chunk in _get_llm(TEXT_TEMPERATURE).astream(_text_messages(prompt)):
+        yield chunk.content
+
+async def astream_code(prompt):
+    logger.info("Streaming code with Gemini 2.0 Flash")
+    async for chunk in _get_llm(CODE_TEMPERATURE).astream(_code_messages(prompt)):
+        yield chunk.content
+
+async def astream_classify(text, categories):
+    logger.info("Streaming classification with Gemini 2.0 Flash")
+    async for chunk in _get_llm(CLASSIFY_TEMPERATURE).astream(_classify_messages(text, categories)):
+        yield chunk.content
+
+def generate_text(prompt):
+    return run_async(agenerate_text(prompt))
+
+def generate_code(prompt):
+    return run_async(agenerate_code(prompt))
+
+def classify_text(text, categories):
+    return run_async(aclassify_text(text, categories))
+
+def stream_text(prompt):
+    return iter_async(astream_text(prompt))
+
+def stream_code(prompt):
+    return iter_async(astream_code(prompt))
+
+def stream_classify(text, categories):
+    return iter_async(astream_classify(text, categories))
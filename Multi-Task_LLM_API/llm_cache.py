@@ -0,0 +1,258 @@
+import os
+import json
+import asyncio
+import atexit
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import wraps
+import faiss
+import numpy as np
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Responses above this temperature are not reproducible enough to be reused
+CACHE_MAX_TEMPERATURE = 0.2
+
+# Minimum cosine similarity for a paraphrased prompt to reuse a cached response
+SIMILARITY_THRESHOLD = 0.92
+# Neighbours inspected per lookup, since the closest ones may belong to another category set
+SEARCH_K = 8
+
+class LLMCache:
+    """In-process TTL cache for LLM responses keyed by a SHA-256 request hash"""
+
+    def __init__(self, maxsize=10_000, ttl=3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._cache),
+                'maxsize': self._cache.maxsize,
+            }
+
+class SemanticCache:
+    """Embedding similarity cache serving stored responses for paraphrased prompts"""
+
+    def __init__(self, dim=768, maxsize=10_000, threshold=SIMILARITY_THRESHOLD, path=None):
+        self.dim = dim
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.path = path
+        self._index = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+        # entry id -> (namespace, response), in least to most recently used order
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(f"{path}.index"):
+            self.load()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype='float32').reshape(1, -1)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def get(self, vector, namespace=None):
+        query = self._normalize(vector)
+        with self._lock:
+            if self._index.ntotal:
+                scores, ids = self._index.search(query, min(SEARCH_K, self._index.ntotal))
+                for score, entry_id in zip(scores[0], ids[0]):
+                    if score < self.threshold:
+                        break
+                    entry = self._entries.get(int(entry_id))
+                    if entry is not None and entry[0] == namespace:
+                        self._entries.move_to_end(int(entry_id))
+                        self.hits += 1
+                        return entry[1]
+            self.misses += 1
+            return None
+
+    def set(self, vector, value, namespace=None):
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(self._normalize(vector), np.array([entry_id], dtype='int64'))
+            self._entries[entry_id] = (namespace, value)
+            self._evict()
+
+    def _evict(self):
+        evicted_ids = []
+        while len(self._entries) > self.maxsize:
+            evicted_id, _ = self._entries.popitem(last=False)
+            evicted_ids.append(evicted_id)
+        if evicted_ids:
+            self._index.remove_ids(np.array(evicted_ids, dtype='int64'))
+
+    def save(self):
+        # Several workers may share one path, so each writes to its own temp
+        # file and renames it into place; the last writer wins
+        suffix = f".{os.getpid()}.tmp"
+        with self._lock:
+            faiss.write_index(self._index, f"{self.path}.index{suffix}")
+            with open(f"{self.path}.json{suffix}", 'w') as f:
+                json.dump({
+                    'next_id': self._next_id,
+                    'entries': [[entry_id, namespace, value] for entry_id, (namespace, value) in self._entries.items()],
+                }, f)
+        os.replace(f"{self.path}.index{suffix}", f"{self.path}.index")
+        os.replace(f"{self.path}.json{suffix}", f"{self.path}.json")
+
+    def load(self):
+        try:
+            index = faiss.read_index(f"{self.path}.index")
+            with open(f"{self.path}.json") as f:
+                data = json.load(f)
+            next_id = data['next_id']
+            saved_entries = data['entries']
+        except (OSError, RuntimeError, ValueError, KeyError) as e:
+            logger.warning(f"Could not load semantic cache from {self.path}, starting empty: {e}")
+            return
+        # The two files may come from different workers' saves, so keep only entries present in both
+        indexed_ids = set(faiss.vector_to_array(index.id_map).tolist())
+        entries = OrderedDict(
+            (entry_id, (namespace, value))
+            for entry_id, namespace, value in saved_entries
+            if entry_id in indexed_ids
+        )
+        orphan_ids = indexed_ids - entries.keys()
+        if orphan_ids:
+            index.remove_ids(np.array(sorted(orphan_ids), dtype='int64'))
+        with self._lock:
+            self._index = index
+            self._entries = entries
+            self._next_id = max([next_id, *(entry_id + 1 for entry_id in indexed_ids)])
+            self._evict()
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+llm_cache = LLMCache()
+# Request key -> future of the call currently serving it, on the shared event loop
+_inflight = {}
+semantic_cache = SemanticCache(path=os.getenv("SEMANTIC_CACHE_PATH"))
+if semantic_cache.path:
+    atexit.register(semantic_cache.save)
+
+def make_request_key(model, temperature, prompt, categories=None):
+    """Build a SHA-256 key identifying an LLM request"""
+    payload = {
+        "m": model,
+        "t": temperature,
+        "p": prompt,
+        "c": sorted(categories) if categories else None,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def make_cache_key(model, temperature, prompt, categories=None):
+    """Build the cache key for a request, or None if the request should not be cached"""
+    if temperature > CACHE_MAX_TEMPERATURE:
+        return None
+    return make_request_key(model, temperature, prompt, categories)
+
+def cached_llm(model, temperature):
+    """Memoize an async wrapper function taking (prompt) or (text, categories)"""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(prompt, categories=None):
+            args = (prompt,) if categories is None else (prompt, categories)
+            key = make_cache_key(model, temperature, prompt, categories)
+            if key is None:
+                return await func(*args)
+            cached = llm_cache.get(key)
+            if cached is not None:
+                logger.info(f"Cache hit for {func.__name__}")
+                return cached
+            result = await func(*args)
+            llm_cache.set(key, result)
+            return result
+        return wrapper
+    return decorator
+
+def _mark_retrieved(future):
+    # Followers may never await the future, so consume its exception here to avoid a warning
+    if not future.cancelled():
+        future.exception()
+
+def single_flight(model, temperature):
+    """Share one call between concurrent callers of an async (prompt) or (text, categories) function"""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(prompt, categories=None):
+            args = (prompt,) if categories is None else (prompt, categories)
+            key = make_request_key(model, temperature, prompt, categories)
+            inflight = _inflight.get(key)
+            if inflight is not None:
+                logger.info(f"Joining in-flight call for {func.__name__}")
+                return await asyncio.shield(inflight)
+            future = asyncio.get_running_loop().create_future()
+            future.add_done_callback(_mark_retrieved)
+            _inflight[key] = future
+            try:
+                result = await func(*args)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                future.set_exception(e)
+                raise
+            else:
+                future.set_result(result)
+                return result
+            finally:
+                del _inflight[key]
+        return wrapper
+    return decorator
+
+def semantic_cached_llm(embed):
+    """Reuse responses of an async (text, categories) function for semantically similar text"""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(text, categories):
+            namespace = json.dumps(sorted(categories))
+            try:
+                vector = await embed(text)
+            except Exception as e:
+                logger.warning(f"Embedding failed, skipping semantic cache: {e}")
+                return await func(text, categories)
+            cached = semantic_cache.get(vector, namespace)
+            if cached is not None:
+                logger.info(f"Semantic cache hit for {func.__name__}")
+                return cached
+            result = await func(text, categories)
+            semantic_cache.set(vector, result, namespace)
+            return result
+        return wrapper
+    return decorator
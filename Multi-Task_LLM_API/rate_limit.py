@@ -0,0 +1,58 @@
+import time
+import logging
+import threading
+import redis
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Refills the bucket for the time elapsed since the last check, then takes one token if available.
+# The clock is Redis's own TIME, so skew between workers sharing the bucket cannot add or remove tokens.
+# ARGV: capacity, refill rate (tokens per second), key TTL (seconds)
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+-- Redis < 5 only allows writes after TIME with effects replication enabled
+if redis.replicate_commands then redis.replicate_commands() end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * refill_rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return allowed
+"""
+
+class TokenBucketLimiter:
+    """Token bucket rate limiter checked with a single atomic script call against Redis"""
+
+    def __init__(self, redis_client=None):
+        self._script = redis_client.register_script(TOKEN_BUCKET_SCRIPT) if redis_client is not None else None
+        # In-process buckets used when Redis is not configured or unreachable
+        self._buckets = TTLCache(maxsize=100_000, ttl=3600)
+        self._lock = threading.Lock()
+
+    def allow(self, key, capacity, refill_rate):
+        """Take one token from the bucket at key, returning False if it is empty"""
+        if self._script is not None:
+            ttl = int(capacity / refill_rate) + 1
+            try:
+                return bool(self._script(keys=[key], args=[capacity, refill_rate, ttl]))
+            except redis.RedisError as e:
+                logger.warning(f"Redis rate limit check failed ({e}), using in-process bucket")
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + max(0, now - updated) * refill_rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            return allowed
@@ -2,11 +2,20 @@ import unittest
 import json
 import os
 import time
+import asyncio
+import tempfile
 import threading
 from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
 from dotenv import load_dotenv
 from app import app
-from gemini_wrapper import generate_text, generate_code, classify_text
+from gemini_wrapper import (
+    generate_text, generate_code, classify_text, run_async, SHARES_ASYNC_CLIENT,
+    _get_llm, TEXT_TEMPERATURE, CODE_TEMPERATURE, CLASSIFY_TEMPERATURE,
+)
+import llm_cache
+from llm_cache import SemanticCache, single_flight
+from rate_limit import TokenBucketLimiter
 
 class TestMultiTaskLLMAPI(unittest.TestCase):
     
@@ -129,6 +138,26 @@ class TestMultiTaskLLMAPI(unittest.TestCase):
         data = json.loads(response.data)
         self.assertIn('error', data)
         
+        # Test wrongly typed categories for classification
+        response = self.client.post(
+            '/api/v1/classify/text',
+            data=json.dumps({"text": "test", "categories": "positive"}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.data)
+        self.assertIn('error', data)
+        self.assertEqual(data['details'][0]['loc'], ['categories'])
+        
+        # Test malformed and empty bodies on every endpoint
+        for endpoint in ['/api/v1/generate/text', '/api/v1/generate/code', '/api/v1/classify/text']:
+            for body in ['{bad', '']:
+                response = self.client.post(endpoint, data=body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                data = json.loads(response.data)
+                self.assertIn('error', data)
+                self.assertEqual(data['details'][0]['type'], 'json_invalid')
+        
         print("✅ Error handling working correctly")
         
     def test_06_rate_limit_handling(self):
@@ -194,13 +223,288 @@ class TestMultiTaskLLMAPI(unittest.TestCase):
         self.assertTrue(len(classification_result) > 0)
         print(f"✅ Direct text classification: {classification_result}")
 
+    def test_08_response_cache_metrics(self):
+        """Test that repeated deterministic calls are served from the cache"""
+        print("\n🗄️ Testing Response Cache...")
+        
+        payload = {
+            "text": "The service was slow and the food was cold.",
+            "categories": ["positive", "negative", "neutral"]
+        }
+        
+        first = classify_text(payload['text'], payload['categories'])
+        before = json.loads(self.client.get('/api/v1/metrics').data)
+        second = classify_text(payload['text'], list(reversed(payload['categories'])))
+        
+        response = self.client.get('/api/v1/metrics')
+        self.assertEqual(response.status_code, 200)
+        after = json.loads(response.data)
+        
+        self.assertEqual(first, second)
+        self.assertEqual(after['hits'], before['hits'] + 1)
+        
+        print(f"✅ Cache stats: {after}")
+
+    def test_09_streaming_response(self):
+        """Test Server-Sent Events streaming on the text generation endpoint"""
+        print("\n📡 Testing Streaming Response...")
+        
+        payload = {
+            "prompt": "Write a two-sentence story about a dog."
+        }
+        
+        response = self.client.post(
+            '/api/v1/generate/text',
+            data=json.dumps(payload),
+            content_type='application/json',
+            headers={'Accept': 'text/event-stream'}
+        )
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        
+        body = response.get_data(as_text=True)
+        self.assertIn('data: ', body)
+        self.assertNotIn('event: error', body)
+        
+        print(f"✅ Streamed events: {body.count(chr(10) + chr(10))}")
+
+    def test_10_endpoint_rate_limit(self):
+        """Test the per-endpoint token bucket rejects bursts beyond its capacity"""
+        print("\n🚦 Testing Endpoint Rate Limit...")
+        
+        # A fresh in-process bucket keeps earlier tests and runs (Redis keys outlive them) out of the count.
+        # Invalid payloads still consume a token, so no Gemini calls are made
+        status_codes = []
+        with patch('app.token_bucket', TokenBucketLimiter()):
+            for _ in range(12):
+                response = self.client.post(
+                    '/api/v1/generate/code',
+                    data=json.dumps({}),
+                    content_type='application/json'
+                )
+                status_codes.append(response.status_code)
+        
+        self.assertEqual(status_codes, [400] * 10 + [429] * 2)
+        data = json.loads(response.data)
+        self.assertIn('error', data)
+        
+        print(f"✅ Requests rejected after burst: {status_codes.count(429)}")
+
+class TestEventStream(unittest.TestCase):
+    """Offline tests for Server-Sent Events framing"""
+
+    def post_streaming(self, chunks):
+        def fake_stream(prompt):
+            for chunk in chunks:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        
+        with patch('app.stream_text', fake_stream), patch('app.token_bucket', TokenBucketLimiter()):
+            response = app.test_client().post(
+                '/api/v1/generate/text',
+                data=json.dumps({"prompt": "hi"}),
+                content_type='application/json',
+                headers={'Accept': 'text/event-stream'}
+            )
+        self.assertEqual(response.status_code, 200)
+        return response.get_data(as_text=True)
+
+    def test_multiline_chunks_stay_in_one_event(self):
+        """Test that newlines inside a chunk are sent as continued data lines"""
+        body = self.post_streaming(["line one\nline two", "\r\nnext"])
+        
+        self.assertEqual(body, "data: line one\ndata: line two\n\ndata: \ndata: next\n\n")
+
+    def test_multiline_error_cannot_inject_events(self):
+        """Test that a multi-line error message stays inside the error event"""
+        body = self.post_streaming(["ok", RuntimeError("boom\n\nevent: injected")])
+        
+        self.assertEqual(body, "data: ok\n\nevent: error\ndata: boom\ndata: \ndata: event: injected\n\n")
+        self.assertNotIn("\nevent: injected", body)
+
+class TestTokenBucketLimiter(unittest.TestCase):
+    """Offline tests for the in-process token bucket"""
+
+    def test_empty_bucket_rejects(self):
+        """Test that requests beyond the capacity are rejected"""
+        limiter = TokenBucketLimiter()
+        with patch('rate_limit.time.time', return_value=1000.0):
+            results = [limiter.allow('client', capacity=3, refill_rate=1) for _ in range(4)]
+        
+        self.assertEqual(results, [True, True, True, False])
+
+    def test_bucket_refills_over_time(self):
+        """Test that tokens refill at the given rate without exceeding the capacity"""
+        limiter = TokenBucketLimiter()
+        with patch('rate_limit.time.time') as now:
+            now.return_value = 1000.0
+            for _ in range(2):
+                limiter.allow('client', capacity=2, refill_rate=0.5)
+            self.assertFalse(limiter.allow('client', capacity=2, refill_rate=0.5))
+            
+            now.return_value = 1002.0
+            self.assertTrue(limiter.allow('client', capacity=2, refill_rate=0.5))
+            self.assertFalse(limiter.allow('client', capacity=2, refill_rate=0.5))
+            
+            now.return_value = 2000.0
+            results = [limiter.allow('client', capacity=2, refill_rate=0.5) for _ in range(3)]
+            self.assertEqual(results, [True, True, False])
+
+    def test_buckets_are_per_key(self):
+        """Test that one client's empty bucket does not limit another"""
+        limiter = TokenBucketLimiter()
+        with patch('rate_limit.time.time', return_value=1000.0):
+            self.assertTrue(limiter.allow('a', capacity=1, refill_rate=1))
+            self.assertFalse(limiter.allow('a', capacity=1, refill_rate=1))
+            self.assertTrue(limiter.allow('b', capacity=1, refill_rate=1))
+
+class TestSharedClient(unittest.TestCase):
+    """Offline tests for sharing one Gemini transport across temperatures"""
+
+    @unittest.skipUnless(SHARES_ASYNC_CLIENT, "installed langchain-google-genai has no shareable async client")
+    def test_temperature_clients_share_transports(self):
+        """Test that every temperature client reuses the base sync and async services"""
+        temperatures = [TEXT_TEMPERATURE, CODE_TEMPERATURE, CLASSIFY_TEMPERATURE]
+        # Building clients makes no network calls, so a placeholder key works offline
+        with patch.dict(os.environ, {'GOOGLE_API_KEY': os.getenv('GOOGLE_API_KEY') or 'AIza-offline-test-key'}):
+            llms = [_get_llm(temperature) for temperature in temperatures]
+        
+        async def async_clients():
+            return [llm.async_client for llm in llms]
+        
+        self.assertEqual([llm.temperature for llm in llms], temperatures)
+        self.assertIsNotNone(llms[0].async_client_running)
+        for llm, async_client in zip(llms, run_async(async_clients())):
+            self.assertIs(llm.client, llms[0].client)
+            self.assertIs(async_client, llms[0].async_client_running)
+
+class TestSingleFlight(unittest.TestCase):
+    """Offline tests for sharing in-flight calls between identical concurrent requests"""
+
+    def test_identical_calls_run_once(self):
+        """Test that concurrent calls with the same key share one execution"""
+        calls = []
+        
+        @single_flight('test-model', 0)
+        async def slow_echo(prompt):
+            calls.append(prompt)
+            await asyncio.sleep(0.05)
+            return prompt.upper()
+        
+        async def run():
+            return await asyncio.gather(*(slow_echo('same') for _ in range(5)), slow_echo('other'))
+        
+        results = run_async(run())
+        
+        self.assertEqual(results, ['SAME'] * 5 + ['OTHER'])
+        self.assertEqual(sorted(calls), ['other', 'same'])
+        self.assertEqual(llm_cache._inflight, {})
+
+    def test_exception_reaches_every_waiter(self):
+        """Test that a failed shared call raises in every concurrent caller"""
+        calls = []
+        
+        @single_flight('test-model', 0)
+        async def slow_failure(prompt):
+            calls.append(prompt)
+            await asyncio.sleep(0.05)
+            raise ValueError('boom')
+        
+        async def run():
+            return await asyncio.gather(*(slow_failure('same') for _ in range(4)), return_exceptions=True)
+        
+        results = run_async(run())
+        
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 4)
+        for result in results:
+            self.assertIsInstance(result, ValueError)
+        self.assertEqual(llm_cache._inflight, {})
+
+class TestSemanticCache(unittest.TestCase):
+    """Offline tests for the embedding similarity cache using synthetic vectors"""
+
+    def test_similarity_threshold(self):
+        """Test that only vectors above the similarity threshold hit"""
+        cache = SemanticCache(dim=4, threshold=0.92)
+        cache.set([1, 0, 0, 0], 'positive', 'ns')
+        
+        self.assertEqual(cache.get([1, 0.1, 0, 0], 'ns'), 'positive')
+        self.assertIsNone(cache.get([1, 1, 0, 0], 'ns'))
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertEqual(cache.stats['misses'], 1)
+
+    def test_namespace_isolation(self):
+        """Test that entries are only served for the same category set"""
+        cache = SemanticCache(dim=4)
+        cache.set([1, 0, 0, 0], 'positive', '["negative", "positive"]')
+        
+        self.assertIsNone(cache.get([1, 0, 0, 0], '["bug", "feature"]'))
+        self.assertEqual(cache.get([1, 0, 0, 0], '["negative", "positive"]'), 'positive')
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted from the index"""
+        cache = SemanticCache(dim=4, maxsize=2)
+        cache.set([1, 0, 0, 0], 'a')
+        cache.set([0, 1, 0, 0], 'b')
+        cache.get([1, 0, 0, 0])
+        cache.set([0, 0, 1, 0], 'c')
+        
+        self.assertEqual(cache._index.ntotal, 2)
+        self.assertEqual(cache.get([1, 0, 0, 0]), 'a')
+        self.assertIsNone(cache.get([0, 1, 0, 0]))
+        self.assertEqual(cache.get([0, 0, 1, 0]), 'c')
+
+    def test_save_load_round_trip(self):
+        """Test that a saved cache is restored, trimmed to maxsize"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'semantic')
+            cache = SemanticCache(dim=4, path=path)
+            cache.set([1, 0, 0, 0], 'a', 'ns')
+            cache.set([0, 1, 0, 0], 'b', 'ns')
+            cache.set([0, 0, 1, 0], 'c', 'ns')
+            cache.save()
+            
+            restored = SemanticCache(dim=4, path=path)
+            self.assertEqual(restored.get([0, 1, 0, 0], 'ns'), 'b')
+            
+            trimmed = SemanticCache(dim=4, maxsize=2, path=path)
+            self.assertEqual(trimmed._index.ntotal, 2)
+            self.assertIsNone(trimmed.get([1, 0, 0, 0], 'ns'))
+            self.assertEqual(trimmed.get([0, 0, 1, 0], 'ns'), 'c')
+            
+            trimmed.set([0, 0, 0, 1], 'd', 'ns')
+            self.assertEqual(trimmed.get([0, 0, 0, 1], 'ns'), 'd')
+
+    def test_load_with_missing_metadata(self):
+        """Test that a missing metadata file starts an empty cache instead of failing"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'semantic')
+            cache = SemanticCache(dim=4, path=path)
+            cache.set([1, 0, 0, 0], 'a')
+            cache.save()
+            os.remove(f"{path}.json")
+            
+            restored = SemanticCache(dim=4, path=path)
+            self.assertEqual(restored.stats['size'], 0)
+            self.assertIsNone(restored.get([1, 0, 0, 0]))
+
 if __name__ == '__main__':
     print("🚀 Starting Multi-Task LLM API Unit Tests...")
     print("=" * 60)
     
     # Create test suite
     loader = unittest.TestLoader()
-    suite = loader.loadTestsFromTestCase(TestMultiTaskLLMAPI)
+    suite = unittest.TestSuite([
+        loader.loadTestsFromTestCase(TestMultiTaskLLMAPI),
+        loader.loadTestsFromTestCase(TestEventStream),
+        loader.loadTestsFromTestCase(TestTokenBucketLimiter),
+        loader.loadTestsFromTestCase(TestSharedClient),
+        loader.loadTestsFromTestCase(TestSingleFlight),
+        loader.loadTestsFromTestCase(TestSemanticCache),
+    ])
     
     # Run tests with detailed output
     runner = unittest.TextTestRunner(verbosity=2, buffer=True)